@@ -1,13 +1,20 @@
-import os
 import logging
+import time
 from typing import Any
 import base64
+import quopri
+import re
+from concurrent.futures import ThreadPoolExecutor
+from email.header import Header
 from google.oauth2.credentials import Credentials
 from googleapiclient.errors import HttpError
+from services.http_service import HttpService
 from services.gmail_service import GmailService
 from services.drive_service import DriveService
 from services.llm_service import LLMService
+from services.cache_service import CacheService
 from services.modification_service import ModificationService
+from services.pubsub_service import PubSubService
 from utils.email_utils import EmailUtils
 from exceptions.exceptions import MessagesNotFound
 from models.models import EventsInfo
@@ -15,6 +22,15 @@ from models.models import EventsInfo
 logger = logging.getLogger(__name__)
 Config = Any
 
+# RFC 5322 limits a line to 998 bytes, and recommends at most 78 per header line.
+MAX_LINE_LENGTH = 998
+MAX_HEADER_LINE_LENGTH = 78
+_LINE_BREAK_RE = re.compile(r"\r\n|\r|\n")
+
+# Gmail stops publishing notifications 7 days after watch() is called; the
+# watch is renewed once it is due to expire within this many seconds.
+WATCH_RENEWAL_MARGIN = 24 * 60 * 60
+
 
 class MeetingPreparationAssistant:
     def __init__(self, config: Config):
@@ -27,37 +43,156 @@ class MeetingPreparationAssistant:
             Read each value stored in the config.yaml.
         """
 
-        creds = None
         token_file = config.token_file
-        if os.path.exists(token_file):
-            creds = Credentials.from_authorized_user_file(
-                config.token_file, config.scopes
-            )
+        try:
+            creds = Credentials.from_authorized_user_file(token_file, config.scopes)
             logger.info("Loaded credentials from token.json")
-        else:
+        except FileNotFoundError:
             logger.error(f"{token_file} not found")
             raise Exception("token.json not found")
 
         try:
+            self.http_service = HttpService(creds)
+            # Processed messages are excluded by Gmail itself, so they never
+            # take up room in the max_email_results page or need to be fetched.
+            processed_label_query = config.processed_label_name.replace(" ", "-")
             self.gmail_service = GmailService(
-                creds, config.max_email_results, config.gmail_query
+                self.http_service,
+                config.max_email_results,
+                f"{config.gmail_query} -label:{processed_label_query}",
+            )
+            self.cache_service = CacheService(
+                config.llm_cache_file, config.llm_cache_max_entries
+            )
+            self.drive_service = DriveService(
+                self.http_service,
+                config.max_concurrent_attachments,
+                self.cache_service,
             )
-            self.drive_service = DriveService(creds)
             self.llm_service = LLMService(
                 config.model_name,
                 config.max_iterations,
                 config.modification_summary_threshold,
                 config.task_generation_temperature,
+                config.task_generation_max_tokens,
+                config.max_concurrent_llm_calls,
+                self.cache_service,
             )
             self.modification_service = ModificationService(config.modifications_file)
-            self.processed_label_id = self.gmail_service.get_or_create_label(
-                config.processed_label_name
+            self.state_service = CacheService(config.state_file)
+            self.processed_label_name = config.processed_label_name
+            self.processed_label_id = self.state_service.get(
+                f"label_id:{self.processed_label_name}"
             )
+            if self.processed_label_id is None:
+                self._refresh_processed_label_id()
+            self._user_email = self.gmail_service.get_profile()["emailAddress"]
             self.email_utils = EmailUtils(self.drive_service, self.llm_service)
+            self.max_concurrent_messages = config.max_concurrent_messages
+            self.pubsub_service = None
+            self.pubsub_topic = config.pubsub_topic
+            if config.pubsub_subscription:
+                self.pubsub_service = PubSubService(
+                    self.http_service, config.pubsub_subscription
+                )
+                self.history_id = self._watch()["historyId"]
         except HttpError as error:
             logger.error(f"An error occurred while initializing services: {error}")
             raise Exception(f"An error occurred: {error}")
 
+    def _refresh_processed_label_id(self):
+        """
+        Look up the 'Processed' label through the Gmail API and remember its ID.
+        """
+        self.processed_label_id = self.gmail_service.get_or_create_label(
+            self.processed_label_name, refresh=True
+        )
+        self.state_service.set(
+            f"label_id:{self.processed_label_name}", self.processed_label_id
+        )
+
+    def _watch(self) -> dict:
+        """
+        Start or renew the Gmail watch and remember when it expires.
+
+        Returns
+        -------
+        dict
+            The watch response containing 'historyId' and 'expiration'.
+        """
+        response = self.gmail_service.watch(self.pubsub_topic)
+        self.watch_expiration = int(response["expiration"]) / 1000
+        return response
+
+    def _has_new_messages(self) -> bool:
+        """
+        Check the Gmail history for messages added since the last check.
+
+        Returns
+        -------
+        bool
+            True if messages were added to the inbox, False otherwise.
+        """
+        try:
+            message_ids, self.history_id = self.gmail_service.get_history(
+                self.history_id
+            )
+        except HttpError as error:
+            # Gmail only keeps a limited history; start over from the current state.
+            if error.resp.status != 404:
+                raise
+            logger.warning("Gmail history ID expired; checking the inbox again")
+            self.history_id = self.gmail_service.get_profile()["historyId"]
+            return True
+        return bool(message_ids)
+
+    def wait_for_new_messages(self, timeout: float):
+        """
+        Block until Gmail reports messages added to the inbox.
+
+        Notifications that do not add messages, such as label changes, are
+        discarded without listing the inbox.
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait for each batch of notifications before checking
+            whether the watch needs to be renewed.
+        """
+        while True:
+            if self.watch_expiration - time.time() < WATCH_RENEWAL_MARGIN:
+                logger.info("Renewing Gmail watch")
+                self._watch()
+            if not self.pubsub_service.wait_for_notifications(timeout=timeout):
+                continue
+            if self._has_new_messages():
+                return
+
+    def mark_processed(self, message_ids: list):
+        """
+        Add the 'Processed' label to messages.
+
+        Parameters
+        ----------
+        message_ids : list
+            The IDs of the processed messages.
+        """
+        try:
+            self.gmail_service.add_label_to_messages(
+                message_ids, self.processed_label_id
+            )
+        except HttpError as error:
+            # The remembered label may have been deleted since it was stored.
+            if error.resp.status not in (400, 404):
+                raise
+            logger.warning(
+                "Stored 'Processed' label ID was rejected; looking it up again"
+            )
+            self._refresh_processed_label_id()
+            self.gmail_service.add_label_to_messages(
+                message_ids, self.processed_label_id
+            )
+
     def fetch_info_from_emails(self) -> EventsInfo:
         """
         Fetch new emails from Gmail containing .ics files and extract event information.
@@ -72,27 +207,47 @@ class MeetingPreparationAssistant:
         MessagesNotFound
             If no new meeting invitations are found.
         """
+        # Attachments are reused across the events of one batch only, so edits
+        # to a shared document show up in the next batch.
+        self.drive_service.reset_attachments()
         messages = self.gmail_service.get_messages_with_ics_attachments()
         if not messages:
             logger.info("No new meeting invitations found")
             raise MessagesNotFound("No new meeting invitations found.")
 
-        unprocessed_messages = self.gmail_service.get_unprocessed_messages(
-            messages, self.processed_label_id
+        # A single fetch returns both the labels and the parsed MIME tree of
+        # each message, so only the parts that are used need decoding.
+        full_messages = self.gmail_service.get_messages_batch(
+            [msg["id"] for msg in messages],
+            format="full",
+            fields="id,labelIds,payload",
         )
+        # Gmail's search index can lag behind label changes, so the labels of
+        # the fetched messages are still checked.
+        unprocessed_messages = []
+        for msg in messages:
+            full_message = full_messages.get(msg["id"])
+            if full_message is None:
+                continue
+            if self.processed_label_id in full_message.get("labelIds", []):
+                logger.info(f"Message ID '{msg['id']}' already processed; skipping")
+                continue
+            unprocessed_messages.append(full_message)
         if not unprocessed_messages:
             logger.info("No unprocessed meeting invitations found")
             raise MessagesNotFound("No unprocessed meeting invitations found.")
+        self.gmail_service.inline_ics_attachments(unprocessed_messages)
 
-        events_info = []
-        for msg in unprocessed_messages:
-            event_info = self.email_utils.process_message(
-                msg, self.gmail_service, self.processed_label_id
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_messages) as executor:
+            results = executor.map(
+                lambda full_message: self.email_utils.process_message(
+                    full_message, self.gmail_service, self.processed_label_id
+                ),
+                unprocessed_messages,
             )
-            if event_info:
-                events_info.append(event_info)
+            events_info = [event_info for event_info in results if event_info]
 
-        return EventsInfo(events_info=events_info)
+        return EventsInfo.model_construct(events_info=events_info)
 
     def send_tasklist(self, tasklist: dict):
         """
@@ -105,13 +260,14 @@ class MeetingPreparationAssistant:
         """
         title = tasklist["title"]
         logger.info(f"Sending task list for event: {title}")
-        body_text = f"Title: {title}\n\nTasks:\n"
+        parts = [f"Title: {title}\n\nTasks:\n"]
         for task in tasklist["tasks"]:
-            body_text += (
+            parts.append(
                 f"""- Task: {task["task"]}\n"""
                 f"""  Duration: {task["task_duration"]} minutes\n"""
                 f"""  Note: {task["note"]}\n\n"""
             )
+        body_text = "".join(parts)
 
         message = self.create_message(f"Task List: {title}", body_text)
         self.send_email(message)
@@ -133,20 +289,34 @@ class MeetingPreparationAssistant:
         dict
             The raw email message ready to be sent.
         """
-        from email.mime.multipart import MIMEMultipart
-        from email.mime.text import MIMEText
-
-        message = MIMEMultipart()
-        to = (
-            self.gmail_service.service.users()
-            .getProfile(userId="me")
-            .execute()["emailAddress"]
-        )
-        message["to"] = to
-        message["subject"] = subject
-        message.attach(MIMEText(body_text, "plain"))
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        return {"raw": raw_message}
+        # A single text/plain part does not need the email package's generator;
+        # only non-ASCII or long subjects need RFC 2047 encoding or folding.
+        subject = " ".join(subject.splitlines())
+        if not subject.isascii():
+            subject = Header(subject, "utf-8").encode(linesep="\r\n")
+        elif len(subject) > MAX_HEADER_LINE_LENGTH:
+            subject = Header(subject).encode(linesep="\r\n")
+        # RFC 5322 lines end in CRLF and are at most 998 bytes long; a body
+        # with longer lines, such as a long LLM-generated note, is sent as
+        # quoted-printable instead.
+        body = _LINE_BREAK_RE.sub("\r\n", body_text).encode()
+        transfer_encoding = "8bit"
+        if any(len(line) > MAX_LINE_LENGTH for line in body.split(b"\r\n")):
+            transfer_encoding = "quoted-printable"
+            body = quopri.encodestring(body.replace(b"\r\n", b"\n")).replace(
+                b"\n", b"\r\n"
+            )
+        raw = (
+            f"To: {self._user_email}\r\n"
+            f"Subject: {subject}\r\n"
+            "MIME-Version: 1.0\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Transfer-Encoding: {transfer_encoding}\r\n"
+            "\r\n"
+        ).encode() + body
+        # The API client serializes the body with json.dumps, so 'raw' must be a
+        # str; base64 output is pure ASCII, which decodes without validation.
+        return {"raw": base64.urlsafe_b64encode(raw).decode("ascii")}
 
     def send_email(self, message: dict) -> dict:
         """
@@ -163,11 +333,12 @@ class MeetingPreparationAssistant:
             The sent message information.
         """
         logger.info("Sending email through Gmail API")
+        # Sends run on a background thread, which needs its own HTTP client.
         message = (
             self.gmail_service.service.users()
             .messages()
             .send(userId="me", body=message)
-            .execute()
+            .execute(http=self.http_service.get())
         )
         logger.info(f"Email sent with Message Id: {message['id']}")
         return message
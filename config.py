@@ -1,32 +1,37 @@
+from dataclasses import make_dataclass
+from functools import lru_cache
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
-class Config:
-    _instance = None
 
-    def __new__(cls, config_path="config.yaml"):
-        if cls._instance is None:
-            cls._instance = super(Config, cls).__new__(cls)
-            cls._instance._load_config(config_path)
-        return cls._instance
+@lru_cache(maxsize=None)
+def load_config(config_path="config.yaml"):
+    return make_config_node(_read_config_file(config_path))
 
-    def _load_config(self, config_path):
-        with open(config_path, "r") as file:
-            config = yaml.safe_load(file)
-        self._load_dict(config)
 
-    def _load_dict(self, config_dict):
-        for key, value in config_dict.items():
-            if isinstance(value, dict):
-                setattr(self, key, ConfigDict(value))
-            else:
-                setattr(self, key, value)
+def _read_config_file(config_path):
+    with open(config_path, "r") as file:
+        return yaml.load(file, Loader=SafeLoader)
 
 
-class ConfigDict:
-    def __init__(self, config_dict):
-        for key, value in config_dict.items():
-            if isinstance(value, dict):
-                setattr(self, key, ConfigDict(value))
-            else:
-                setattr(self, key, value)
+def make_config_node(config_dict):
+    # Each mapping becomes a frozen, slotted dataclass generated from its keys:
+    # no per-instance __dict__, and attribute reads resolve to fixed slots.
+    node_cls = make_dataclass("ConfigDict", list(config_dict), frozen=True, slots=True)
+    return node_cls(
+        **{key: _make_config_value(value) for key, value in config_dict.items()}
+    )
+
+
+def _make_config_value(value):
+    # Lists such as `scopes` become tuples, so the loaded config is immutable
+    # throughout and can be shared as-is with the API clients.
+    if isinstance(value, dict):
+        return make_config_node(value)
+    if isinstance(value, list):
+        return tuple(_make_config_value(item) for item in value)
+    return value
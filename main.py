@@ -1,6 +1,8 @@
 import logging
+import random
 import time
-from config import Config
+from concurrent.futures import ThreadPoolExecutor
+from config import load_config
 from assistant.meeting_preparation_assistant import MeetingPreparationAssistant
 from exceptions.exceptions import MessagesNotFound
 from googleapiclient.errors import HttpError
@@ -8,7 +10,46 @@ from googleapiclient.errors import HttpError
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-config = Config()
+config = load_config()
+
+
+def process_new_emails(mpa: MeetingPreparationAssistant) -> bool:
+    """Send task lists for new meeting invitations and return whether any were found."""
+    try:
+        events = mpa.fetch_info_from_emails()
+    except MessagesNotFound:
+        logger.info("No new messages found; waiting before retrying")
+        return False
+
+    # Task lists are sent in the background, in order, so the next event's tasks
+    # are generated and reviewed while the previous email is in flight.
+    pending_sends = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        try:
+            for event_info in events.events_info:
+                modifications = mpa.modification_service.load_modifications()
+                task_list, modification = mpa.llm_service.generate_tasks(
+                    event_info, modifications
+                )
+                send = executor.submit(mpa.send_tasklist, task_list)
+                pending_sends.append((event_info.message_id, send))
+                if modification:
+                    mpa.modification_service.save_modifications(modification)
+        finally:
+            # Label everything that was sent, even if another event failed.
+            processed_message_ids = []
+            send_error = None
+            for message_id, send in pending_sends:
+                try:
+                    send.result()
+                    processed_message_ids.append(message_id)
+                except Exception as error:
+                    send_error = send_error or error
+            if processed_message_ids:
+                mpa.mark_processed(processed_message_ids)
+            if send_error is not None:
+                raise send_error
+    return bool(events.events_info)
 
 
 def main():
@@ -16,22 +57,24 @@ def main():
     try:
         logger.info("Starting Meeting Preparation Assistant")
         mpa = MeetingPreparationAssistant(config)
+        backoff = 1
         while True:
             try:
-                events = mpa.fetch_info_from_emails()
-                for event_info in events.events_info:
-                    modifications = mpa.modification_service.load_modifications()
-                    task_list, modification = mpa.llm_service.generate_tasks(
-                        event_info, modifications
-                    )
-                    mpa.send_tasklist(task_list)
-                    if modification:
-                        mpa.modification_service.save_modifications(modification)
-                    mpa.gmail_service.add_label_to_message(
-                        event_info.message_id, mpa.processed_label_id
-                    )
-            except MessagesNotFound:
-                logger.info("No new messages found; waiting before retrying")
+                found_events = process_new_emails(mpa)
+                if found_events:
+                    # Invitations tend to arrive in bursts, and more may be left
+                    # beyond the first page of results; check again right away.
+                    backoff = 1
+                    continue
+                if mpa.pubsub_service is not None:
+                    logger.info("Waiting for Gmail push notifications")
+                    mpa.wait_for_new_messages(config.email_polling_retry_interval)
+                else:
+                    delay = min(backoff, config.email_polling_retry_interval)
+                    delay += random.random() * 5
+                    logger.info(f"Waiting for {delay:.0f} seconds before checking for new emails")
+                    time.sleep(delay)
+                    backoff = min(backoff * 2, config.email_polling_retry_interval)
             except HttpError as error:
                 logger.error(f"An HTTP error occurred: {error}")
                 break
@@ -39,9 +82,6 @@ def main():
                 logger.error(f"An unexpected error occurred: {e}")
                 break
 
-            logger.info(f"Waiting for {config.email_polling_retry_interval // 60} minutes before checking for new emails")
-            time.sleep(config.email_polling_retry_interval)
-
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt detected.")
         time.sleep(0.5)
@@ -1,8 +1,10 @@
 import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class IsMeetingInvite(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     is_meeting_invite: bool = Field(
         default=False,
         description="A boolean indicating if the email content is a meeting invitation.",
@@ -10,6 +12,8 @@ class IsMeetingInvite(BaseModel):
 
 
 class EventInfo(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     message_id: str = Field(description="The ID of the email message.")
     event_title: str = Field(description="The title of the event.")
     description: str = Field(description="A detailed description of the event.")
@@ -30,12 +34,16 @@ class EventInfo(BaseModel):
 
 
 class EventsInfo(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     events_info: list[EventInfo] = Field(
         description="A list containing information about multiple events."
     )
 
 
 class Task(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     task: str = Field(
         description="Represents the task required to prepare for a scheduled event."
     )
@@ -46,6 +54,8 @@ class Task(BaseModel):
 
 
 class TaskList(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     title: str = Field(description="The title of the event.")
     tasks: list[Task] = Field(
         description="A list representing the tasks required to prepare for a scheduled event."
@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+class CacheService:
+    def __init__(self, cache_file: Path, max_entries: int | None = None):
+        """
+        Initialize the CacheService.
+
+        Entries are persisted as an append-only JSON Lines log of [key, value]
+        pairs, in which the last line of a key wins. The log is compacted into
+        the live entries once it has grown to twice their number.
+
+        Parameters
+        ----------
+        cache_file : Path
+            The file path to persist cached entries.
+        max_entries : int or None
+            Maximum number of entries kept, evicting the least recently used
+            ones first, or None to keep every entry.
+        """
+        self.cache_filepath = Path(cache_file)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._log_lines = 0
+        self._entries = self._load_entries()
+
+    def _load_entries(self) -> dict:
+        """
+        Load cached entries from the log file.
+
+        Returns
+        -------
+        dict
+            A mapping from cache key to cached value, oldest first.
+        """
+        try:
+            data = self.cache_filepath.read_bytes()
+        except FileNotFoundError:
+            logger.info(
+                f"No cache file found at {self.cache_filepath}. Starting with an empty cache."
+            )
+            return {}
+        except Exception as e:
+            logger.error(f"Failed to load cache from {self.cache_filepath}: {e}")
+            return {}
+
+        entries = {}
+        needs_compaction = False
+        if data.lstrip().startswith(b"{"):
+            # Earlier versions stored the cache as a single JSON object.
+            try:
+                entries = orjson.loads(data)
+            except orjson.JSONDecodeError as e:
+                logger.error(f"Failed to load cache from {self.cache_filepath}: {e}")
+            needs_compaction = True
+        else:
+            for line in data.splitlines():
+                if not line.strip():
+                    continue
+                self._log_lines += 1
+                # A line left half-written by a crash only loses itself.
+                try:
+                    key, value = orjson.loads(line)
+                except (orjson.JSONDecodeError, ValueError) as e:
+                    logger.warning(
+                        f"Skipping invalid line in {self.cache_filepath}: {e}"
+                    )
+                    needs_compaction = True
+                    continue
+                entries.pop(key, None)
+                entries[key] = value
+            needs_compaction = needs_compaction or not data.endswith(b"\n")
+
+        self._entries = entries
+        self._evict()
+        if needs_compaction:
+            self._compact()
+        logger.info(
+            f"Loaded {len(self._entries)} cache entries from {self.cache_filepath}."
+        )
+        return self._entries
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Retrieve a cached value.
+
+        Parameters
+        ----------
+        key : str
+            The cache key.
+        default : Any
+            The value returned when the key is not cached.
+
+        Returns
+        -------
+        Any
+            The cached value, or `default` if not found.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            # Moving the entry to the end keeps the dict in recency order.
+            value = self._entries[key] = self._entries.pop(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        """
+        Store a value in the cache and persist it.
+
+        Parameters
+        ----------
+        key : str
+            The cache key.
+        value : Any
+            A JSON-serializable value to cache.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            self._evict()
+            try:
+                with self.cache_filepath.open("ab") as f:
+                    f.write(orjson.dumps([key, value]) + b"\n")
+                self._log_lines += 1
+                if self._log_lines > 2 * max(len(self._entries), 1):
+                    self._compact()
+            except Exception as e:
+                logger.error(f"Failed to save cache to {self.cache_filepath}: {e}")
+
+    def _evict(self):
+        """
+        Drop the least recently used entries beyond `max_entries`.
+        """
+        if self.max_entries is None:
+            return
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    def _compact(self):
+        """
+        Rewrite the log with only the live entries.
+
+        The log is written to a temporary file that then replaces it, so a
+        crash leaves either the old or the new log in place.
+        """
+        tmp_filepath = self.cache_filepath.with_name(self.cache_filepath.name + ".tmp")
+        try:
+            tmp_filepath.write_bytes(
+                b"".join(
+                    orjson.dumps([key, value]) + b"\n"
+                    for key, value in self._entries.items()
+                )
+            )
+            os.replace(tmp_filepath, self.cache_filepath)
+            self._log_lines = len(self._entries)
+        except Exception as e:
+            logger.error(f"Failed to compact cache at {self.cache_filepath}: {e}")
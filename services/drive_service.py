@@ -1,38 +1,94 @@
 import logging
 import re
 import io
-from typing import Any
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Iterator
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.http import (
+    DEFAULT_CHUNK_SIZE,
+    BatchHttpRequest,
+    MediaIoBaseDownload,
+)
 from googleapiclient.errors import HttpError
-from pypdf import PdfReader
+import pypdfium2 as pdfium
+from services.http_service import API_NUM_RETRIES
 
 logger = logging.getLogger(__name__)
-Credentials = LLMService = Any
+HttpService = LLMService = CacheService = Any
+
+# The metadata fields read for each attachment.
+FILE_METADATA_FIELDS = "name,mimeType,modifiedTime"
+
+# Matches both the "?id={id}" and the "/d/{id}/" forms of Drive URLs.
+_FILE_ID_RE = re.compile(r"(?:[?&]id=|/d/)([a-zA-Z0-9_-]+)")
+
+# Attachment content is truncated to this many characters before it is summarized.
+MAX_ATTACHMENT_CHARS = 10**4
+
+# Drive accepts at most 100 sub-requests in a single batch request.
+BATCH_REQUEST_LIMIT = 100
+
+# Messages and their attachments are both processed on thread pools, so the
+# number of Google API requests in flight at once is capped separately.
+MAX_CONCURRENT_REQUESTS = 10
+
+# PDFium is not thread-safe, so its calls are serialized across threads.
+_pdfium_lock = threading.Lock()
+
+
+def _extract_page_text(pdf: pdfium.PdfDocument, page_number: int) -> str:
+    """Extract the text of a single page with PDFium."""
+    page = pdf[page_number]
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range()
+    finally:
+        textpage.close()
+        page.close()
 
 
 class DriveService:
-    def __init__(self, creds: Credentials):
+    def __init__(
+        self,
+        http_service: HttpService,
+        max_concurrent_attachments: int,
+        cache_service: CacheService,
+    ):
         """
         Initialize the Google Drive API service.
 
         Parameters
         ----------
-        creds : Credentials
-            OAuth2 credentials for Drive API access.
+        http_service : HttpService
+            An instance of HttpService providing authorized HTTP clients.
+        max_concurrent_attachments : int
+            Maximum number of attachments of an event processed in parallel.
+        cache_service : CacheService
+            An instance of CacheService used to reuse attachment summaries.
         """
+        self.http_service = http_service
+        self.max_concurrent_attachments = max_concurrent_attachments
+        self.cache_service = cache_service
+        self._attachments = {}
+        self._attachments_lock = threading.Lock()
+        self._request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+        # Requests made without an explicit client share the connections of
+        # the thread that built the services.
+        http = http_service.get()
         try:
             self.drive_service = build(
-                "drive", "v3", credentials=creds, cache_discovery=False
+                "drive", "v3", http=http, static_discovery=True
             )
             self.docs_service = build(
-                "docs", "v1", credentials=creds, cache_discovery=False
+                "docs", "v1", http=http, static_discovery=True
             )
             self.sheets_service = build(
-                "sheets", "v4", credentials=creds, cache_discovery=False
+                "sheets", "v4", http=http, static_discovery=True
             )
             self.slides_service = build(
-                "slides", "v1", credentials=creds, cache_discovery=False
+                "slides", "v1", http=http, static_discovery=True
             )
 
             logger.info("Initialized Drive API service.")
@@ -40,6 +96,27 @@ class DriveService:
             logger.error(f"Error initializing Drive service: {error}")
             raise Exception(f"An error occurred: {error}")
 
+    def _execute(self, request: Any) -> Any:
+        """
+        Execute an API request once a request slot is free.
+
+        Parameters
+        ----------
+        request : Any
+            The HttpRequest or BatchHttpRequest to execute.
+
+        Returns
+        -------
+        Any
+            The response of the request.
+        """
+        with self._request_slots:
+            if isinstance(request, BatchHttpRequest):
+                return request.execute(http=self.http_service.get())
+            return request.execute(
+                http=self.http_service.get(), num_retries=API_NUM_RETRIES
+            )
+
     def fetch_attachments(self, attachments: list, llm_service: LLMService):
         """
         Handle and process attachments from the event.
@@ -57,7 +134,7 @@ class DriveService:
             A list of dictionaries containing attachment titles and their summarized contents.
         """
         logger.info("Fetching and processing attachments")
-        attachment_contents = []
+        file_ids = []
         for attachment in attachments:
             file_id = self.extract_file_id(attachment)
             if not file_id:
@@ -65,42 +142,160 @@ class DriveService:
                     f"Could not extract file ID from attachment URL: {attachment}"
                 )
                 continue
-            logger.info(f"Processing attachment with file ID: {file_id}")
+            file_ids.append(file_id)
+        if not file_ids:
+            return []
+
+        # An attachment shared by several events, such as the standing deck of
+        # a recurring meeting, is processed once and the result reused.
+        with self._attachments_lock:
+            new_file_ids = [
+                file_id
+                for file_id in dict.fromkeys(file_ids)
+                if file_id not in self._attachments
+            ]
+            for file_id in new_file_ids:
+                self._attachments[file_id] = Future()
+            futures = {file_id: self._attachments[file_id] for file_id in file_ids}
+
+        if new_file_ids:
+            try:
+                # The metadata of every attachment is fetched in one round trip.
+                metadata = self.get_files_metadata(new_file_ids)
+                # Each attachment is I/O bound on Drive and the LLM; worker
+                # threads execute their API requests over their own HTTP clients.
+                with ThreadPoolExecutor(
+                    max_workers=min(self.max_concurrent_attachments, len(new_file_ids))
+                ) as executor:
+                    for file_id in new_file_ids:
+                        executor.submit(
+                            self._resolve_attachment,
+                            futures[file_id],
+                            file_id,
+                            metadata.get(file_id),
+                            llm_service,
+                        )
+            except BaseException as error:
+                # Other events may already be waiting on these attachments, so
+                # they are failed rather than left pending forever.
+                with self._attachments_lock:
+                    for file_id in new_file_ids:
+                        future = futures[file_id]
+                        if not future.done():
+                            future.set_exception(error)
+                        if self._attachments.get(file_id) is future:
+                            del self._attachments[file_id]
+                raise
+        return [futures[file_id].result() for file_id in file_ids]
+
+    def reset_attachments(self):
+        """
+        Forget the attachments processed for the previous batch of events.
+        """
+        with self._attachments_lock:
+            self._attachments = {}
+
+    def _resolve_attachment(
+        self,
+        future: Future,
+        file_id: str,
+        meta_data: dict | None,
+        llm_service: LLMService,
+    ):
+        """
+        Process an attachment and publish the result to the events waiting for it.
+
+        Parameters
+        ----------
+        future : Future
+            The future receiving the processed attachment.
+        file_id : str
+            The ID of the attachment file.
+        meta_data : dict or None
+            Metadata of the file, or None to fetch it.
+        llm_service : LLMService
+            An instance of LLMService.
+        """
+        try:
+            future.set_result(
+                self._process_attachment(file_id, meta_data, llm_service)
+            )
+        except Exception as error:
+            future.set_exception(error)
+
+    def _process_attachment(
+        self, file_id: str, meta_data: dict | None, llm_service: LLMService
+    ) -> dict:
+        """
+        Read and summarize a single attachment.
+
+        Parameters
+        ----------
+        file_id : str
+            The ID of the attachment file.
+        meta_data : dict or None
+            Metadata of the file, or None to fetch it.
+        llm_service : LLMService
+            An instance of LLMService.
+
+        Returns
+        -------
+        dict
+            The attachment title and its summarized content.
+        """
+        logger.info(f"Processing attachment with file ID: {file_id}")
+        if meta_data is None:
             meta_data = self.get_file_metadata(file_id)
-            title = meta_data.get("name")
-            mime_type = meta_data.get("mimeType")
-            logger.info(f"Attachment '{title}' has MIME type '{mime_type}'")
-
-            content = ""
-            if mime_type == "application/vnd.google-apps.document":
-                content = self.read_google_doc(file_id)
-            elif mime_type == "application/vnd.google-apps.spreadsheet":
-                content = self.read_google_sheet(file_id)
-            elif mime_type == "application/vnd.google-apps.presentation":
-                content = self.read_google_slide(file_id)
-            elif mime_type == "application/pdf":
-                content = self.download_and_extract_pdf(file_id)
-            elif mime_type in ["text/plain", "text/csv"]:
-                content = self.download_file_as_text(file_id)
-            else:
-                content = "Unsupported file format."
-                logger.warning(
-                    f"Unsupported MIME type '{mime_type}' for attachment '{title}'"
-                )
-            if len(content) > 10**4:
-                logger.info(
-                    f"Content length for attachment '{title}' exceeds limit, truncating to 10,000 characters"
-                )
-                content = content[: 10**4]
-            summarized_content = llm_service.summarize_with_llm(content)
-            attachment_contents.append(
-                {
+        title = meta_data.get("name")
+        mime_type = meta_data.get("mimeType")
+        logger.info(f"Attachment '{title}' has MIME type '{mime_type}'")
+
+        # A file that has not been modified since it was last summarized is
+        # neither downloaded nor summarized again. Only the key of its summary
+        # is stored here, so the summary itself is cached once.
+        cache_key = None
+        if meta_data.get("modifiedTime"):
+            cache_key = f"attachment:{file_id}:{meta_data['modifiedTime']}"
+            summary_key = self.cache_service.get(cache_key)
+            cached_summary = (
+                self.cache_service.get(summary_key) if summary_key else None
+            )
+            if cached_summary is not None:
+                logger.info(f"Reusing cached summary for attachment '{title}'")
+                return {
                     "attachment_title": title,
-                    "content": summarized_content,
+                    "content": cached_summary,
                 }
+
+        content = ""
+        if mime_type == "application/vnd.google-apps.document":
+            content = self.read_google_doc(file_id)
+        elif mime_type == "application/vnd.google-apps.spreadsheet":
+            content = self.read_google_sheet(file_id)
+        elif mime_type == "application/vnd.google-apps.presentation":
+            content = self.read_google_slide(file_id)
+        elif mime_type == "application/pdf":
+            content = self.download_and_extract_pdf(file_id)
+        elif mime_type in ["text/plain", "text/csv"]:
+            content = self.download_file_as_text(file_id)
+        else:
+            content = "Unsupported file format."
+            logger.warning(
+                f"Unsupported MIME type '{mime_type}' for attachment '{title}'"
+            )
+        if len(content) > MAX_ATTACHMENT_CHARS:
+            logger.info(
+                f"Content length for attachment '{title}' exceeds limit, truncating to 10,000 characters"
             )
-            logger.info(f"Processed attachment '{title}'")
-        return attachment_contents
+            content = content[:MAX_ATTACHMENT_CHARS]
+        summarized_content = llm_service.summarize_with_llm(content)
+        if cache_key is not None:
+            self.cache_service.set(cache_key, llm_service.summary_cache_key(content))
+        logger.info(f"Processed attachment '{title}'")
+        return {
+            "attachment_title": title,
+            "content": summarized_content,
+        }
 
     def extract_file_id(self, url: str) -> str | None:
         """
@@ -116,7 +311,7 @@ class DriveService:
         str or None
             The extracted file ID, or None if not found.
         """
-        match = re.search(r"id=([a-zA-Z0-9_-]+)", url)
+        match = _FILE_ID_RE.search(url)
         if match:
             return match.group(1)
         else:
@@ -138,9 +333,55 @@ class DriveService:
             Metadata of the file.
         """
         logger.info(f"Fetching metadata for file ID: {file_id}")
-        return self.drive_service.files().get(fileId=file_id).execute()
+        return self._execute(
+            self.drive_service.files().get(fileId=file_id, fields=FILE_METADATA_FIELDS)
+        )
+
+    def get_files_metadata(self, file_ids: list) -> dict:
+        """
+        Retrieve metadata for several files using as few HTTP round trips as possible.
+
+        Parameters
+        ----------
+        file_ids : list
+            The IDs of the files.
+
+        Returns
+        -------
+        dict
+            A mapping from file ID to the metadata of the file. Files whose
+            metadata could not be fetched are left out.
+        """
+        logger.info(f"Fetching metadata for {len(file_ids)} files")
+        metadata = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logger.error(
+                    f"Error fetching metadata for file ID '{request_id}': {exception}"
+                )
+                return
+            metadata[request_id] = response
+
+        unique_file_ids = list(dict.fromkeys(file_ids))
+        try:
+            for start in range(0, len(unique_file_ids), BATCH_REQUEST_LIMIT):
+                batch = self.drive_service.new_batch_http_request(callback=callback)
+                for file_id in unique_file_ids[start : start + BATCH_REQUEST_LIMIT]:
+                    batch.add(
+                        self.drive_service.files().get(
+                            fileId=file_id, fields=FILE_METADATA_FIELDS
+                        ),
+                        request_id=file_id,
+                    )
+                self._execute(batch)
+        except HttpError as error:
+            logger.warning(f"Batch metadata request failed: {error}")
+        return metadata
 
-    def read_google_doc(self, file_id: str) -> str:
+    def read_google_doc(
+        self, file_id: str, max_chars: int = MAX_ATTACHMENT_CHARS
+    ) -> str:
         """
         Extract text content from a Google Doc.
 
@@ -148,6 +389,8 @@ class DriveService:
         ----------
         file_id : str
             The ID of the Google Doc file.
+        max_chars : int
+            Stop reading once at least this many characters have been read.
 
         Returns
         -------
@@ -155,8 +398,14 @@ class DriveService:
             The text content extracted from the Google Doc.
         """
         logger.info(f"Reading Google Doc with file ID: {file_id}")
-        text = ""
-        doc = self.docs_service.documents().get(documentId=file_id).execute()
+        doc = self._execute(
+            self.docs_service.documents().get(
+                documentId=file_id,
+                fields="body/content/paragraph/elements/textRun/content",
+            )
+        )
+        parts = []
+        length = 0
         for content in doc.get("body", {}).get("content", []):
             paragraph = content.get("paragraph")
             if paragraph:
@@ -164,10 +413,15 @@ class DriveService:
                 for element in elements:
                     text_run = element.get("textRun")
                     if text_run:
-                        text += text_run.get("content", "")
-        return text
+                        parts.append(text_run.get("content", ""))
+                        length += len(parts[-1])
+                        if length >= max_chars:
+                            return "".join(parts)
+        return "".join(parts)
 
-    def read_google_sheet(self, file_id: str) -> str:
+    def read_google_sheet(
+        self, file_id: str, max_chars: int = MAX_ATTACHMENT_CHARS
+    ) -> str:
         """
         Retrieve text content from a Google Sheet.
 
@@ -175,6 +429,8 @@ class DriveService:
         ----------
         file_id : str
             The ID of the Google Sheet file.
+        max_chars : int
+            Stop reading once at least this many characters have been read.
 
         Returns
         -------
@@ -183,14 +439,23 @@ class DriveService:
         """
         logger.info(f"Reading Google Sheet with file ID: {file_id}")
         sheet = self.sheets_service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=file_id, range="A1:Z1000").execute()
+        result = self._execute(
+            sheet.values().get(spreadsheetId=file_id, range="A1:Z1000")
+        )
         values = result.get("values", [])
-        text = ""
+        parts = []
+        length = 0
         for row in values:
-            text += ", ".join(row) + "\n"
-        return text
+            # Cells are strings when formatted, but may be numbers or booleans.
+            parts.append(", ".join(map(str, row)) + "\n")
+            length += len(parts[-1])
+            if length >= max_chars:
+                break
+        return "".join(parts)
 
-    def read_google_slide(self, file_id: str) -> str:
+    def read_google_slide(
+        self, file_id: str, max_chars: int = MAX_ATTACHMENT_CHARS
+    ) -> str:
         """
         Retrieve text content from a Google Slide presentation.
 
@@ -198,6 +463,8 @@ class DriveService:
         ----------
         file_id : str
             The ID of the Google Slide file.
+        max_chars : int
+            Stop reading once at least this many characters have been read.
 
         Returns
         -------
@@ -205,11 +472,15 @@ class DriveService:
             The text content extracted from the Google Slides presentation.
         """
         logger.info(f"Reading Google Slides presentation with file ID: {file_id}")
-        presentation = (
-            self.slides_service.presentations().get(presentationId=file_id).execute()
+        presentation = self._execute(
+            self.slides_service.presentations().get(
+                presentationId=file_id,
+                fields="slides/pageElements/shape/text/textElements/textRun/content",
+            )
         )
         slides = presentation.get("slides", [])
-        text = ""
+        parts = []
+        length = 0
         for slide in slides:
             for element in slide.get("pageElements", []):
                 shape = element.get("shape")
@@ -220,10 +491,84 @@ class DriveService:
                         if text_run:
                             content = text_run.get("content", "")
                             if content:
-                                text += content
-        return text
+                                parts.append(content)
+                                length += len(content)
+                                if length >= max_chars:
+                                    return "".join(parts)
+        return "".join(parts)
+
+    def download_media(self, file_id: str, max_bytes: int | None = None) -> bytes:
+        """
+        Download the content of a binary file.
+
+        Parameters
+        ----------
+        file_id : str
+            The ID of the file.
+        max_bytes : int or None
+            Stop downloading once at least this many bytes have been received,
+            or None to download the whole file.
+
+        Returns
+        -------
+        bytes
+            The content of the file.
+        """
+        request = self.drive_service.files().get_media(fileId=file_id)
+        request.http = self.http_service.get()
+        fh = io.BytesIO()
+        # The default chunk of 100 MiB fetches most files in a single request;
+        # a capped download only asks for what it needs.
+        chunksize = DEFAULT_CHUNK_SIZE
+        if max_bytes is not None:
+            chunksize = min(chunksize, max_bytes)
+        downloader = MediaIoBaseDownload(fh, request, chunksize=chunksize)
+        done = False
+        with self._request_slots:
+            while not done:
+                status, done = downloader.next_chunk(num_retries=API_NUM_RETRIES)
+                logger.debug("Download progress: %d%%", status.progress() * 100)
+                if max_bytes is not None and fh.tell() >= max_bytes:
+                    break
+        return fh.getvalue()
+
+    def iter_pdf_text(self, file_id: str) -> Iterator[str]:
+        """
+        Download a PDF file and yield the text of its pages in order.
+
+        Each page is released as soon as its text has been extracted, and
+        extraction stops as soon as the caller stops iterating.
+
+        Parameters
+        ----------
+        file_id : str
+            The ID of the PDF file.
 
-    def download_and_extract_pdf(self, file_id: str) -> str:
+        Yields
+        ------
+        str
+            The text content of each page.
+        """
+        logger.info(f"Downloading and extracting PDF with file ID: {file_id}")
+        pdf_bytes = self.download_media(file_id)
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            page_count = len(pdf)
+
+        # Native extraction is fast and usually stops after the first few
+        # pages, so pages are extracted one by one rather than on a pool.
+        try:
+            for page_number in range(page_count):
+                with _pdfium_lock:
+                    page_text = _extract_page_text(pdf, page_number)
+                yield page_text
+        finally:
+            with _pdfium_lock:
+                pdf.close()
+
+    def download_and_extract_pdf(
+        self, file_id: str, max_chars: int = MAX_ATTACHMENT_CHARS
+    ) -> str:
         """
         Download a PDF file and extract text from it.
 
@@ -231,28 +576,27 @@ class DriveService:
         ----------
         file_id : str
             The ID of the PDF file.
+        max_chars : int
+            Stop reading once at least this many characters have been read.
 
         Returns
         -------
         str
             The text content extracted from the PDF.
         """
-        logger.info(f"Downloading and extracting PDF with file ID: {file_id}")
-        request = self.drive_service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-            logger.debug(f"Download progress: {int(status.progress() * 100)}%")
-        fh.seek(0)
-        reader = PdfReader(fh)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-        return text
-
-    def download_file_as_text(self, file_id: str) -> str:
+        # Pages past the limit are never extracted.
+        parts = []
+        length = 0
+        for page_text in self.iter_pdf_text(file_id):
+            parts.append(page_text)
+            length += len(page_text)
+            if length >= max_chars:
+                break
+        return "".join(parts)
+
+    def download_file_as_text(
+        self, file_id: str, max_chars: int = MAX_ATTACHMENT_CHARS
+    ) -> str:
         """
         Download a text or CSV file and return its content.
 
@@ -260,6 +604,8 @@ class DriveService:
         ----------
         file_id : str
             The ID of the text or CSV file.
+        max_chars : int
+            Stop reading once at least this many characters have been read.
 
         Returns
         -------
@@ -267,13 +613,10 @@ class DriveService:
             The text content of the file.
         """
         logger.info(f"Downloading file as text with file ID: {file_id}")
-        request = self.drive_service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-            logger.debug(f"Download progress: {int(status.progress() * 100)}%")
-        fh.seek(0)
-        text = fh.read().decode("utf-8")
-        return text
+        # A UTF-8 character takes at most 4 bytes.
+        max_bytes = max_chars * 4
+        data = self.download_media(file_id, max_bytes)
+        if len(data) >= max_bytes:
+            # The download may have stopped in the middle of a character.
+            return data.decode("utf-8", errors="ignore")
+        return data.decode("utf-8")
@@ -1,25 +1,32 @@
 import base64
 import logging
-import email
-from email import message_from_bytes
-from email.header import decode_header
-from typing import Any
+from email.header import decode_header, make_header
+from typing import Any, Iterator
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from services.http_service import API_NUM_RETRIES
 
 logger = logging.getLogger(__name__)
-Credentials = Any
+HttpService = Any
+
+# Gmail accepts up to 100 sub-requests in a single batch request, but large
+# batches trip its per-user concurrency limit and fail with 429s.
+BATCH_REQUEST_LIMIT = 25
+# Gmail accepts at most 1000 message IDs in a single batchModify call.
+BATCH_MODIFY_LIMIT = 1000
 
 
 class GmailService:
-    def __init__(self, creds: Credentials, max_email_results: int, gmail_query: str):
+    def __init__(
+        self, http_service: HttpService, max_email_results: int, gmail_query: str
+    ):
         """
         Initialize the Gmail API service.
 
         Parameters
         ----------
-        creds : Credentials
-            OAuth2 credentials for Gmail API access.
+        http_service : HttpService
+            An instance of HttpService providing authorized HTTP clients.
         max_email_results : int
             Maximum number of emails to process at a time.
         gmail_query : str
@@ -27,17 +34,35 @@ class GmailService:
         """
         self.max_email_results = max_email_results
         self.gmail_query = gmail_query
+        self.http_service = http_service
+        self._labels_by_name = None
 
         try:
             self.service = build(
-                "gmail", "v1", credentials=creds, cache_discovery=False
+                "gmail", "v1", http=http_service.get(), static_discovery=True
             )
             logger.info("Initialized Gmail API service.")
         except HttpError as error:
             logger.error(f"Error initializing Gmail service: {error}")
             raise Exception(f"An error occurred: {error}")
 
-    def get_or_create_label(self, label_name: str) -> str:
+    def get_profile(self) -> dict:
+        """
+        Retrieve the Gmail profile of the authenticated user.
+
+        Returns
+        -------
+        dict
+            The profile containing 'emailAddress' and 'historyId'.
+        """
+        logger.info("Fetching Gmail profile")
+        return (
+            self.service.users()
+            .getProfile(userId="me")
+            .execute(num_retries=API_NUM_RETRIES)
+        )
+
+    def get_or_create_label(self, label_name: str, refresh: bool = False) -> str:
         """
         Retrieve the ID of the specified label. Create it if it doesn't exist.
 
@@ -45,6 +70,8 @@ class GmailService:
         ----------
         label_name : str
             The name of the label.
+        refresh : bool
+            Whether to list the labels again instead of using the cached ones.
 
         Returns
         -------
@@ -53,11 +80,24 @@ class GmailService:
         """
         logger.info(f"Getting or creating label: {label_name}")
         try:
-            labels = self.service.users().labels().list(userId="me").execute()
-            for label in labels["labels"]:
-                if label["name"] == label_name:
-                    logger.info(f"Found label '{label_name}' with ID: {label['id']}")
-                    return label["id"]
+            if (
+                refresh
+                or self._labels_by_name is None
+                or label_name not in self._labels_by_name
+            ):
+                labels = (
+                    self.service.users()
+                    .labels()
+                    .list(userId="me", fields="labels(id,name)")
+                    .execute(num_retries=API_NUM_RETRIES)
+                )
+                self._labels_by_name = {
+                    label["name"]: label["id"] for label in labels["labels"]
+                }
+            if label_name in self._labels_by_name:
+                label_id = self._labels_by_name[label_name]
+                logger.info(f"Found label '{label_name}' with ID: {label_id}")
+                return label_id
 
             label_body = {
                 "name": label_name,
@@ -70,33 +110,105 @@ class GmailService:
                 .create(userId="me", body=label_body)
                 .execute()
             )
+            self._labels_by_name[label_name] = created_label["id"]
             logger.info(f"Created label '{label_name}' with ID: {created_label['id']}")
             return created_label["id"]
         except HttpError as error:
             logger.error(f"Error getting or creating label '{label_name}': {error}")
             raise
 
-    def add_label_to_message(self, message_id: str, label_id: str):
+    def add_label_to_messages(self, message_ids: list, label_id: str):
         """
-        Add a label to a specific message.
+        Add a label to several messages.
 
         Parameters
         ----------
-        message_id : str
-            The ID of the message.
+        message_ids : list
+            The IDs of the messages.
         label_id : str
             The ID of the label to add.
         """
-        logger.info(f"Adding label ID '{label_id}' to message ID '{message_id}'")
+        logger.info(f"Adding label ID '{label_id}' to {len(message_ids)} messages")
+        try:
+            for start in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+                self.service.users().messages().batchModify(
+                    userId="me",
+                    body={
+                        "ids": message_ids[start : start + BATCH_MODIFY_LIMIT],
+                        "addLabelIds": [label_id],
+                    },
+                ).execute(num_retries=API_NUM_RETRIES)
+            logger.info("Added label ID '%s' to messages: %s", label_id, message_ids)
+        except HttpError as error:
+            logger.error(f"Error adding label to messages: {error}")
+            raise
+
+    def watch(self, topic_name: str) -> dict:
+        """
+        Ask Gmail to publish inbox changes to a Cloud Pub/Sub topic.
+
+        Parameters
+        ----------
+        topic_name : str
+            The full name of the Pub/Sub topic.
+
+        Returns
+        -------
+        dict
+            The watch response containing 'historyId' and 'expiration'.
+        """
+        logger.info(f"Watching inbox changes via Pub/Sub topic: {topic_name}")
         try:
-            self.service.users().messages().modify(
-                userId="me", id=message_id, body={"addLabelIds": [label_id]}
-            ).execute()
-            logger.info(f"Added label ID '{label_id}' to message ID '{message_id}'")
+            return (
+                self.service.users()
+                .watch(
+                    userId="me", body={"topicName": topic_name, "labelIds": ["INBOX"]}
+                )
+                .execute(num_retries=API_NUM_RETRIES)
+            )
         except HttpError as error:
-            logger.error(f"Error adding label to message: {error}")
+            logger.error(f"Error watching inbox changes: {error}")
             raise
 
+    def get_history(self, start_history_id: str) -> tuple:
+        """
+        Retrieve the messages added to the inbox since a history ID.
+
+        Parameters
+        ----------
+        start_history_id : str
+            The history ID to list changes from.
+
+        Returns
+        -------
+        tuple
+            The IDs of the added messages and the latest history ID.
+        """
+        message_ids = []
+        history_id = start_history_id
+        page_token = None
+        while True:
+            response = (
+                self.service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded"],
+                    labelId="INBOX",
+                    pageToken=page_token,
+                    fields="history/messagesAdded/message/id,historyId,nextPageToken",
+                )
+                .execute(num_retries=API_NUM_RETRIES)
+            )
+            for history in response.get("history", []):
+                for added in history.get("messagesAdded", []):
+                    message_ids.append(added["message"]["id"])
+            history_id = response.get("historyId", history_id)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return message_ids, history_id
+
     def get_messages_with_ics_attachments(self):
         """
         Retrieve messages that contain .ics attachments.
@@ -109,92 +221,234 @@ class GmailService:
         response = (
             self.service.users()
             .messages()
-            .list(userId="me", q=self.gmail_query, maxResults=self.max_email_results)
-            .execute()
+            .list(
+                userId="me",
+                q=self.gmail_query,
+                maxResults=self.max_email_results,
+                fields="messages/id",
+            )
+            .execute(num_retries=API_NUM_RETRIES)
         )
         return response.get("messages", [])
 
-    def get_unprocessed_messages(self, messages: list, processed_label_id: str) -> list:
+    def get_messages_batch(
+        self, message_ids: list, format: str = "full", fields: str | None = None
+    ) -> dict:
         """
-        Filter messages to find those without the 'Processed' label.
+        Retrieve several messages using as few HTTP round trips as possible.
 
         Parameters
         ----------
-        messages : list
-            A list of message objects.
-        processed_label_id : str
-            The ID of the 'Processed' label.
+        message_ids : list
+            The IDs of the messages to retrieve.
+        format : str
+            The format in which the messages are returned.
+        fields : str or None
+            The fields to include in each message, or None for all of them.
 
         Returns
         -------
-        list
-            A list of unprocessed message objects.
+        dict
+            A mapping from message ID to the message resource, without the
+            messages that could not be fetched.
         """
-        unprocessed_messages = []
-        for msg in messages:
-            msg_metadata = (
-                self.service.users()
-                .messages()
-                .get(userId="me", id=msg["id"], format="metadata")
-                .execute()
-            )
-            label_ids = msg_metadata.get("labelIds", [])
-            if processed_label_id not in label_ids:
-                unprocessed_messages.append(msg)
-            else:
-                logger.info(f"Message ID '{msg['id']}' already processed; skipping")
-        return unprocessed_messages
+        messages = {}
+        failed_ids = []
 
-    def get_email_message(self, message_id: str) -> email.message.Message:
-        """
-        Retrieve the full email message by ID.
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logger.warning(
+                    f"Error fetching message ID '{request_id}' in batch: {exception}"
+                )
+                failed_ids.append(request_id)
+                return
+            messages[request_id] = response
 
-        Parameters
-        ----------
-        message_id : str
-            The ID of the email message.
+        try:
+            for start in range(0, len(message_ids), BATCH_REQUEST_LIMIT):
+                batch = self.service.new_batch_http_request(callback=callback)
+                for message_id in message_ids[start : start + BATCH_REQUEST_LIMIT]:
+                    batch.add(
+                        self.service.users()
+                        .messages()
+                        .get(
+                            userId="me", id=message_id, format=format, fields=fields
+                        ),
+                        request_id=message_id,
+                    )
+                batch.execute()
+        except HttpError as error:
+            logger.warning(
+                f"Batch request failed; fetching messages one by one: {error}"
+            )
+            failed_ids = [
+                message_id for message_id in message_ids if message_id not in messages
+            ]
 
-        Returns
-        -------
-        email.message.Message
-            The email message object.
-        """
-        msg_full = (
-            self.service.users()
-            .messages()
-            .get(userId="me", id=message_id, format="raw")
-            .execute()
-        )
-        msg_bytes = base64.urlsafe_b64decode(msg_full["raw"])
-        return message_from_bytes(msg_bytes)
+        # Requests that failed inside a batch, e.g. on rate limiting, are not
+        # retried by it, so they are fetched again one by one with retries.
+        for message_id in failed_ids:
+            try:
+                messages[message_id] = (
+                    self.service.users()
+                    .messages()
+                    .get(userId="me", id=message_id, format=format, fields=fields)
+                    .execute(num_retries=API_NUM_RETRIES)
+                )
+            except HttpError as error:
+                logger.error(f"Error fetching message ID '{message_id}': {error}")
+        return messages
 
-    def extract_email_parts(self, email_message: email.message.Message) -> tuple:
+    def extract_payload_parts(self, msg_full: dict) -> tuple:
         """
-        Extract subject, body, and .ics file data from an email message.
+        Extract subject, body, and .ics file data from a message fetched in the 'full' format.
+
+        Only the parts that are needed are base64-decoded, and attachment data
+        that Gmail does not inline is downloaded only for the .ics file.
 
         Parameters
         ----------
-        email_message : email.message.Message
-            The email message to extract from.
+        msg_full : dict
+            The message resource containing the parsed 'payload'.
 
         Returns
         -------
         tuple
             Subject, body text, and .ics file data in bytes.
         """
-        subject, encoding = decode_header(email_message["subject"])[0]
-        if isinstance(subject, bytes):
-            subject = subject.decode(encoding or "utf-8")
+        payload = msg_full["payload"]
+        subject = ""
+        for header in payload.get("headers", []):
+            if header["name"].lower() == "subject":
+                subject = str(make_header(decode_header(header["value"])))
+                break
 
         body = ""
         ics_file_data = b""
-        for part in email_message.walk():
-            content_disposition = str(part.get("Content-Disposition"))
-            if part.get_content_type() == "text/plain":
-                body = part.get_payload(decode=True).decode("utf-8")
-            elif "attachment" in content_disposition:
-                file_name = part.get_filename()
-                if file_name and file_name.endswith(".ics"):
-                    ics_file_data = part.get_payload(decode=True)
+        for part in self._iter_leaf_parts(payload):
+            file_name = part.get("filename")
+            if part.get("mimeType") == "text/plain":
+                if not body:
+                    body = self._get_part_data(msg_full["id"], part).decode("utf-8")
+            elif not ics_file_data and file_name and file_name.endswith(".ics"):
+                content_disposition = ""
+                for header in part.get("headers", []):
+                    if header["name"].lower() == "content-disposition":
+                        content_disposition = header["value"]
+                        break
+                if "attachment" in content_disposition:
+                    ics_file_data = self._get_part_data(msg_full["id"], part)
                     logger.info(f"Found .ics attachment: {file_name}")
+            if body and ics_file_data:
+                break
         return subject, body, ics_file_data
+
+    @staticmethod
+    def _iter_leaf_parts(payload: dict) -> Iterator[dict]:
+        """
+        Yield the non-container parts of a 'full' payload in MIME order.
+
+        Parameters
+        ----------
+        payload : dict
+            The payload of a message fetched in the 'full' format.
+
+        Yields
+        ------
+        dict
+            Each part that carries content.
+        """
+        parts = [payload]
+        while parts:
+            part = parts.pop()
+            children = part.get("parts")
+            if children:
+                # Children are visited in order, as email.message.Message.walk does.
+                parts.extend(reversed(children))
+            else:
+                yield part
+
+    def inline_ics_attachments(self, messages: list):
+        """
+        Download the .ics attachments that Gmail did not inline, in batch requests.
+
+        The data is stored in the parts of the given messages, so it is not
+        downloaded again when the messages are processed.
+
+        Parameters
+        ----------
+        messages : list
+            Message resources fetched in the 'full' format.
+        """
+        pending = []
+        for msg in messages:
+            for part in self._iter_leaf_parts(msg["payload"]):
+                file_name = part.get("filename")
+                part_body = part.get("body", {})
+                if (
+                    file_name
+                    and file_name.endswith(".ics")
+                    and "data" not in part_body
+                    and "attachmentId" in part_body
+                ):
+                    pending.append((msg["id"], part_body))
+        if not pending:
+            return
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                # The attachment is downloaded on its own when it is needed.
+                logger.error(f"Error fetching .ics attachment: {exception}")
+                return
+            pending[int(request_id)][1]["data"] = response["data"]
+
+        logger.info(f"Fetching {len(pending)} .ics attachments")
+        try:
+            for start in range(0, len(pending), BATCH_REQUEST_LIMIT):
+                batch = self.service.new_batch_http_request(callback=callback)
+                end = min(start + BATCH_REQUEST_LIMIT, len(pending))
+                for index in range(start, end):
+                    message_id, part_body = pending[index]
+                    batch.add(
+                        self.service.users()
+                        .messages()
+                        .attachments()
+                        .get(
+                            userId="me",
+                            messageId=message_id,
+                            id=part_body["attachmentId"],
+                        ),
+                        request_id=str(index),
+                    )
+                batch.execute()
+        except HttpError as error:
+            logger.warning(f"Batch attachment request failed: {error}")
+
+    def _get_part_data(self, message_id: str, part: dict) -> bytes:
+        """
+        Decode the body of a message part, downloading it if it is not inlined.
+
+        Parameters
+        ----------
+        message_id : str
+            The ID of the message the part belongs to.
+        part : dict
+            The message part from the 'full' payload.
+
+        Returns
+        -------
+        bytes
+            The decoded body of the part.
+        """
+        part_body = part.get("body", {})
+        data = part_body.get("data")
+        if data is None and "attachmentId" in part_body:
+            attachment = (
+                self.service.users()
+                .messages()
+                .attachments()
+                .get(userId="me", messageId=message_id, id=part_body["attachmentId"])
+                .execute(http=self.http_service.get(), num_retries=API_NUM_RETRIES)
+            )
+            data = attachment["data"]
+        return base64.urlsafe_b64decode(data) if data else b""
@@ -0,0 +1,45 @@
+import logging
+import threading
+from typing import Any
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+
+logger = logging.getLogger(__name__)
+Credentials = Any
+
+# Idempotent requests that fail with a 5xx or rate-limit error are retried this
+# many times, with randomized exponential backoff between attempts.
+API_NUM_RETRIES = 3
+
+
+class HttpService:
+    def __init__(self, creds: Credentials):
+        """
+        Initialize the HTTP clients shared by the Google API services.
+
+        Parameters
+        ----------
+        creds : Credentials
+            OAuth2 credentials used to authorize every request.
+        """
+        self.creds = creds
+        self._local = threading.local()
+
+    def get(self) -> AuthorizedHttp:
+        """
+        Return the authorized HTTP client owned by the calling thread.
+
+        httplib2 connections are not thread-safe, so each thread executes its
+        requests over its own client, and keeps its connections alive across
+        every Google API it calls.
+
+        Returns
+        -------
+        AuthorizedHttp
+            The HTTP client for the calling thread.
+        """
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._local.http = http
+        return http
@@ -1,12 +1,188 @@
+import hashlib
 import logging
+import re
+import threading
 from typing import Any
+import orjson
 from langchain_databricks import ChatDatabricks
+from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.outputs import Generation
 from langchain_core.prompts import ChatPromptTemplate
-from models.models import IsMeetingInvite, TaskList
+from pydantic import ValidationError
+from models.models import IsMeetingInvite, Task, TaskList
 
 logger = logging.getLogger(__name__)
-EventInfo = Any
+EventInfo = CacheService = Any
+
+
+# A markdown-escaped underscore, unless its backslash is itself escaped.
+_ESCAPED_UNDERSCORE_RE = re.compile(r"(?<!\\)((?:\\\\)*)\\_")
+
+
+class PydanticJsonOutputParser(JsonOutputParser):
+    """
+    JSON output parser that validates well-formed responses in a single pass.
+
+    A plain JSON response is parsed and validated by pydantic-core directly;
+    anything else, such as JSON wrapped in a markdown code block, falls back to
+    the lenient parsing of JsonOutputParser and is validated afterwards. Partial
+    results are returned as parsed, without validation. Models tend to
+    markdown-escape the underscores of field names, which is not a valid JSON
+    escape, so a response that fails to parse is retried with them unescaped.
+    """
+
+    def parse_result(self, result: list[Generation], *, partial: bool = False) -> Any:
+        text = result[0].text
+        if not partial:
+            try:
+                return self.pydantic_object.model_validate_json(text).model_dump()
+            except ValidationError:
+                pass
+        try:
+            parsed = super().parse_result(result, partial=partial)
+        except OutputParserException:
+            if not _ESCAPED_UNDERSCORE_RE.search(text):
+                raise
+            parsed = None
+        if parsed is None and _ESCAPED_UNDERSCORE_RE.search(text):
+            unescaped = _ESCAPED_UNDERSCORE_RE.sub(r"\1_", text)
+            parsed = super().parse_result([Generation(text=unescaped)], partial=partial)
+        if partial:
+            return parsed
+        # A complete response is validated whichever way it was parsed.
+        try:
+            return self.pydantic_object.model_validate(parsed).model_dump()
+        except ValidationError as error:
+            raise OutputParserException(
+                f"Invalid {self.pydantic_object.__name__}: {error}", llm_output=text
+            ) from error
+
+
+# Format instructions depend only on the output models, so they are rendered
+# once at import and bound into the prompts below.
+INVITE_PARSER = PydanticJsonOutputParser(pydantic_object=IsMeetingInvite)
+TASK_PARSER = PydanticJsonOutputParser(pydantic_object=TaskList)
+INVITE_FORMAT_INSTRUCTIONS = INVITE_PARSER.get_format_instructions()
+TASK_FORMAT_INSTRUCTIONS = TASK_PARSER.get_format_instructions()
+
+# Static instructions are kept at module level so every request starts with a
+# byte-identical prefix that the serving endpoint can reuse across calls.
+# Per-call values are placed at the end of the human message for the same reason.
+TASK_GENERATION_SYSTEM_PROMPT = (
+    "Review the meeting invitation email and create clear, actionable tasks based on the details.\n"
+    "Focus on tasks that help the recipient prepare for the meeting, like reviewing documents, "
+    "understanding the agenda, or identifying key discussion points.\n"
+    "Ensure each task is directly related to the meeting content and easy to follow.\n"
+    "\n"
+    "## Instructions\n"
+    "Based on the event details, please propose:\n"
+    "- Tasks that should be completed before the event starts\n"
+    "- The duration required for each task\n"
+    "- Points to keep in mind for each task\n"
+    "\n"
+    "## Output Format\n"
+    "{format_instructions}"
+)
+
+TASK_GENERATION_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", TASK_GENERATION_SYSTEM_PROMPT),
+        ("human", "{event_details}{additional_instructions}"),
+    ]
+).partial(format_instructions=TASK_FORMAT_INSTRUCTIONS)
+
+# A task list that fails validation, such as one cut off by the token limit,
+# is generated again up to this many times in total.
+MAX_TASK_GENERATION_ATTEMPTS = 2
+
+EVENT_DETAILS_TEMPLATE = """
+## Event Details
+Event Summary: {title}
+Description: {description}
+Meeting Duration (hours): {event_duration}
+Number of Participants: {num_ppl}
+Summaries of Attachments: {att_contents}
+"""
+
+INVITE_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """
+            You are a helpful assistant.
+
+            ## Instruction
+            Is the following email content a meeting invitation?
+
+            ## Answer construction
+            Answer {format_instructions}
+            """,
+        ),
+        (
+            "human",
+            """
+            ## Email content
+            Subject: {subject}
+            Body: {body}
+            """,
+        ),
+    ]
+).partial(format_instructions=INVITE_FORMAT_INSTRUCTIONS)
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "You are a summarization assistant. "
+            "Please summarize the text given by the user.",
+        ),
+        ("human", "{content}"),
+    ]
+)
+
+MODIFICATION_SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "You are a helpful assistant that summarizes user feedback for improving task generation.",
+        ),
+        (
+            "human",
+            """
+            You have received the following user feedback to improve task generation:
+            {modifications}
+
+            Please provide a concise summary of the feedback to incorporate into the task generation instructions.
+            """,
+        ),
+    ]
+)
+
+MODIFICATION_UPDATE_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "You are a helpful assistant that summarizes user feedback for improving task generation.",
+        ),
+        (
+            "human",
+            """
+            You have previously summarized user feedback to improve task generation as follows:
+            {summary}
+
+            You have since received the following additional feedback:
+            {modifications}
+
+            Please provide an updated concise summary of all the feedback to incorporate into the task generation instructions.
+            """,
+        ),
+    ]
+)
+
+# Cache entry holding the summary of the longest list of modifications seen so
+# far, which later feedback is folded into.
+LATEST_MODIFICATION_SUMMARY_KEY = "modifications:latest"
 
 
 class LLMService:
@@ -16,6 +192,9 @@ class LLMService:
         max_iterations: int,
         modification_summary_threshold: int,
         task_generation_temperature: float,
+        task_generation_max_tokens: int,
+        max_concurrent_llm_calls: int,
+        cache_service: CacheService,
     ):
         """
         Initialize the Language Model service.
@@ -30,11 +209,60 @@ class LLMService:
             Number of feedback entries before summarizing.
         task_generation_temperature : float
             Control the LLM that generates tasks.
+        task_generation_max_tokens : int
+            Maximum number of tokens the LLM generates for a task list.
+        max_concurrent_llm_calls : int
+            Maximum number of LLM requests in flight at once.
+        cache_service : CacheService
+            An instance of CacheService used to reuse LLM results.
         """
         self.model_name = model_name
         self.max_iterations = max_iterations
         self.modification_summary_threshold = modification_summary_threshold
         self.task_generation_temperature = task_generation_temperature
+        self.task_generation_max_tokens = task_generation_max_tokens
+        self.cache_service = cache_service
+        # Messages and attachments are processed on thread pools; this bounds
+        # the LLM requests they issue together to the endpoint's rate limit.
+        self._llm_slots = threading.BoundedSemaphore(max_concurrent_llm_calls)
+        # Clients and chains are built once and shared by every call.
+        self.invite_chain = (
+            INVITE_PROMPT | ChatDatabricks(endpoint=model_name) | INVITE_PARSER
+        )
+        self.summary_chain = SUMMARY_PROMPT | ChatDatabricks(
+            endpoint=model_name, max_tokens=150
+        )
+        modification_llm = ChatDatabricks(endpoint=model_name, temperature=0.0)
+        self.modification_chain = MODIFICATION_SUMMARY_PROMPT | modification_llm
+        self.modification_update_chain = MODIFICATION_UPDATE_PROMPT | modification_llm
+        self.task_chain = (
+            TASK_GENERATION_PROMPT
+            | ChatDatabricks(
+                endpoint=model_name,
+                temperature=task_generation_temperature,
+                max_tokens=task_generation_max_tokens,
+            )
+        )
+
+    @staticmethod
+    def _cache_key(namespace: str, *parts: Any) -> str:
+        """
+        Build a cache key from the inputs that determine an LLM result.
+
+        Parameters
+        ----------
+        namespace : str
+            The kind of result being cached.
+        *parts : Any
+            The inputs of the LLM call.
+
+        Returns
+        -------
+        str
+            The cache key.
+        """
+        payload = orjson.dumps(parts, default=str, option=orjson.OPT_SORT_KEYS)
+        return f"{namespace}:{hashlib.sha256(payload).hexdigest()}"
 
     def is_meeting_invite(self, subject: str, body: str) -> bool:
         """
@@ -52,43 +280,38 @@ class LLMService:
         bool
             True if the email is a meeting invitation, False otherwise.
         """
+        # Invitations sent again unchanged, such as reminders of a recurring
+        # meeting, are classified only once.
+        cache_key = self._cache_key("invite", subject, body)
+        cached_is_invite = self.cache_service.get(cache_key)
+        if cached_is_invite is not None:
+            logger.info(f"Reusing cached is_meeting_invite: {cached_is_invite}")
+            return cached_is_invite
+
         logger.info("Determining if email is a meeting invitation using LLM")
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", "You are a helpful assistant."),
-                (
-                    "human",
-                    """
-                    ## Instruction
-                    Is the following email content a meeting invitation?
-
-                    ## Email content
-                    Subject: {subject}
-                    Body: {body}
-
-                    ## Answer construction
-                    Answer {format_instructions}
-                    """,
-                ),
-            ]
-        )
-        parser = JsonOutputParser(pydantic_object=IsMeetingInvite)
-        llm = ChatDatabricks(endpoint=self.model_name)
-        chain = prompt | llm | parser
-        result = chain.invoke(
-            {
-                "subject": subject,
-                "body": body,
-                "format_instructions": parser.get_format_instructions(),
-            }
-        )
-        replaced_result = {
-            key.replace("\\", ""): value for key, value in result.items()
-        }
-        is_invite = replaced_result["is_meeting_invite"]
+        with self._llm_slots:
+            result = self.invite_chain.invoke({"subject": subject, "body": body})
+        is_invite = result["is_meeting_invite"]
+        self.cache_service.set(cache_key, is_invite)
         logger.info(f"LLM determined is_meeting_invite: {is_invite}")
         return is_invite
 
+    def summary_cache_key(self, content: str) -> str:
+        """
+        Return the key under which the summary of the content is cached.
+
+        Parameters
+        ----------
+        content : str
+            The text content to be summarized.
+
+        Returns
+        -------
+        str
+            The cache key.
+        """
+        return self._cache_key("summary", content)
+
     def summarize_with_llm(self, content: str) -> str:
         """
         Use LLM to summarize the given content.
@@ -103,16 +326,17 @@ class LLMService:
         str
             The summarized text.
         """
+        # Recurring attachments such as weekly agendas are summarized only once.
+        cache_key = self.summary_cache_key(content)
+        cached_summary = self.cache_service.get(cache_key)
+        if cached_summary is not None:
+            logger.info("Reusing cached summary for content")
+            return cached_summary
+
         logger.info("Summarizing content using LLM")
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", "You are a summarization assistant."),
-                ("human", "Please summarize the following text: {content}"),
-            ]
-        )
-        llm = ChatDatabricks(endpoint=self.model_name, max_tokens=150)
-        chain = prompt | llm
-        summary = chain.invoke({"content": content}).content
+        with self._llm_slots:
+            summary = self.summary_chain.invoke({"content": content}).content
+        self.cache_service.set(cache_key, summary)
         logger.info("Content summarized using LLM")
         return summary
 
@@ -130,28 +354,44 @@ class LLMService:
         str
             The summarized modifications.
         """
-        logger.info("Summarizing accumulated modifications.")
-
-        llm = ChatDatabricks(endpoint=self.model_name, temperature=0.0)
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    "You are a helpful assistant that summarizes user feedback for improving task generation.",
-                ),
-                (
-                    "human",
-                    """
-                    You have received the following user feedback to improve task generation:
-                    {modifications}
-
-                    Please provide a concise summary of the feedback to incorporate into the task generation instructions.
-                    """,
-                ),
-            ]
+        # The feedback only changes when the user gives more, so every event in
+        # between reuses the same summary.
+        cache_key = self._cache_key("modifications", modifications)
+        cached_summary = self.cache_service.get(cache_key)
+        if cached_summary is not None:
+            logger.info("Reusing cached summary of modifications.")
+            return cached_summary
+
+        # Feedback is only ever appended, so new entries are folded into the
+        # previous summary instead of summarizing the whole list again.
+        latest = self.cache_service.get(LATEST_MODIFICATION_SUMMARY_KEY)
+        if (
+            latest is not None
+            and latest["count"] < len(modifications)
+            and latest["key"]
+            == self._cache_key("modifications", modifications[: latest["count"]])
+        ):
+            logger.info(
+                f"Updating the summary with {len(modifications) - latest['count']} new modifications."
+            )
+            with self._llm_slots:
+                summarized_mod = self.modification_update_chain.invoke(
+                    {
+                        "summary": latest["summary"],
+                        "modifications": modifications[latest["count"] :],
+                    }
+                ).content
+        else:
+            logger.info("Summarizing accumulated modifications.")
+            with self._llm_slots:
+                summarized_mod = self.modification_chain.invoke(
+                    {"modifications": modifications}
+                ).content
+        self.cache_service.set(cache_key, summarized_mod)
+        self.cache_service.set(
+            LATEST_MODIFICATION_SUMMARY_KEY,
+            {"count": len(modifications), "key": cache_key, "summary": summarized_mod},
         )
-        chain = prompt | llm
-        summarized_mod = chain.invoke({"modifications": modifications}).content
         logger.info("Successfully summarized modifications.")
         return summarized_mod
 
@@ -178,71 +418,53 @@ class LLMService:
         num_ppl = event_info.num_ppl
         att_contents = event_info.att_contents
 
-        base_prompt = """
-        ## Event Details
-        Event Summary: {title}
-        Description: {description}
-        Meeting Duration (hours): {event_duration}
-        Number of Participants: {num_ppl}
-        Summaries of Attachments: {att_contents}
-
-        ## Instructions
-        Based on the above event details, please propose:
-        - Tasks that should be completed before the event starts
-        - The duration required for each task
-        - Points to keep in mind for each task
-
-        ## Output Format
-        {format_instructions}
-        """
-
+        # The event details are rendered once and stay a fixed prefix of the
+        # prompt; only the additional instructions grow between iterations.
+        event_details = EVENT_DETAILS_TEMPLATE.format(
+            title=title,
+            description=description,
+            event_duration=event_duration,
+            num_ppl=num_ppl,
+            att_contents=att_contents,
+        )
+        additional_instructions = ""
         if len(modifications) >= self.modification_summary_threshold:
             summarized_mod = self.summarize_modifications(modifications)
-            base_prompt += f"\n\n## Additional Instructions\n{summarized_mod}"
-        parser = JsonOutputParser(pydantic_object=TaskList)
+            additional_instructions += (
+                f"\n\n## Additional Instructions\n{summarized_mod}"
+            )
+
+        cache_key = self._cache_key(
+            "tasks",
+            title,
+            description,
+            event_duration,
+            num_ppl,
+            att_contents,
+            modifications,
+        )
+        cached_result = self.cache_service.get(cache_key)
 
         iteration = 0
         modification = None
+        rejected_results = set()
         while iteration < self.max_iterations:
             iteration += 1
-            prompt = ChatPromptTemplate.from_messages(
-                [
-                    (
-                        "system",
-                        """
-                        Review the meeting invitation email and create clear, actionable tasks based on the details.
-                        Focus on tasks that help the recipient prepare for the meeting, like reviewing documents, understanding the agenda, or identifying key discussion points.
-                        Ensure each task is directly related to the meeting content and easy to follow.
-                        """,
-                    ),
-                    ("human", base_prompt),
-                ]
-            )
-            llm = ChatDatabricks(
-                endpoint=self.model_name, temperature=self.task_generation_temperature
-            )
-            chain = prompt | llm | parser
-            result = chain.invoke(
-                {
-                    "title": title,
-                    "description": description,
-                    "event_duration": event_duration,
-                    "num_ppl": num_ppl,
-                    "att_contents": att_contents,
-                    "format_instructions": parser.get_format_instructions(),
-                }
-            )
-            replaced_result = {
-                key.replace("\\", ""): value for key, value in result.items()
-            }
             print("Generated Tasks:")
-            for i, task in enumerate(replaced_result["tasks"]):
-                if i == 0:
-                    print("=" * 100)
-                print(f"""task title: {task["task"]}""")
-                print(f"""task duration: {task["task_duration"]}""")
-                print(f"""note: {task["note"]}""")
-                print("=" * 100)
+            if iteration == 1 and cached_result is not None:
+                logger.info(f"Reusing cached tasks for event: {title}")
+                replaced_result = cached_result
+                for i, task in enumerate(replaced_result["tasks"]):
+                    self._print_task(task, first=i == 0)
+            else:
+                replaced_result = self._stream_tasks(
+                    event_details, additional_instructions
+                )
+            result_key = self._cache_key("tasks", replaced_result)
+            if result_key in rejected_results:
+                print(
+                    "The feedback did not change the tasks. Please give more specific feedback."
+                )
 
             feedback = (
                 input(
@@ -253,16 +475,104 @@ class LLMService:
             )
             if feedback == "yes":
                 logger.info(f"User is satisfied with the tasks for event: {title}")
+                self.cache_service.set(cache_key, replaced_result)
                 break
             else:
+                rejected_results.add(result_key)
                 if iteration < self.max_iterations:
                     modification = input(
                         "Please provide your feedback to improve the tasks:\n"
                     )
-                    base_prompt += f"\n\n## Additional Instructions\n{modification}"
+                    additional_instructions += (
+                        f"\n\n## Additional Instructions\n{modification}"
+                    )
                 else:
                     logger.info(
                         "Maximum iterations reached. Proceeding with the latest tasks."
                     )
         logger.info(f"Generated tasks for event: {title}")
         return replaced_result, modification
+
+    def _stream_tasks(self, event_details: str, additional_instructions: str) -> dict:
+        """
+        Ask the LLM for a TaskList and print each task as soon as it is complete.
+
+        Parameters
+        ----------
+        event_details : str
+            The rendered details of the event.
+        additional_instructions : str
+            Instructions derived from user feedback, appended after the details.
+
+        Returns
+        -------
+        dict
+            A dictionary representing the TaskList.
+        """
+        for attempt in range(1, MAX_TASK_GENERATION_ATTEMPTS + 1):
+            parts = []
+            printed = 0
+            for chunk in self.task_chain.stream(
+                {
+                    "event_details": event_details,
+                    "additional_instructions": additional_instructions,
+                }
+            ):
+                parts.append(chunk.content)
+                # A task is complete once the next one has started, which can
+                # only happen after an object has closed.
+                if "}" not in chunk.content:
+                    continue
+                partial = TASK_PARSER.parse_result(
+                    [Generation(text="".join(parts))], partial=True
+                )
+                if not isinstance(partial, dict):
+                    continue
+                for task in (partial.get("tasks") or [])[printed:-1]:
+                    try:
+                        task = Task.model_validate(task).model_dump()
+                    except ValidationError:
+                        # Left for the validation of the complete response.
+                        break
+                    self._print_task(task, first=printed == 0)
+                    printed += 1
+
+            # The complete response is validated, so a list cut off by the
+            # token limit is never printed, cached or sent as if it were whole.
+            try:
+                result = TASK_PARSER.parse_result([Generation(text="".join(parts))])
+                break
+            except OutputParserException as error:
+                if attempt == MAX_TASK_GENERATION_ATTEMPTS:
+                    raise
+                logger.warning(f"Invalid task list from LLM, retrying: {error}")
+                print("The generated task list was incomplete. Generating it again.")
+
+        for task in result["tasks"][printed:]:
+            self._print_task(task, first=printed == 0)
+            printed += 1
+        return result
+
+    @staticmethod
+    def _print_task(task: dict, first: bool = False):
+        """
+        Print a generated task for the user to review.
+
+        Parameters
+        ----------
+        task : dict
+            A dictionary representing a Task.
+        first : bool
+            Whether the task is the first one of the list.
+        """
+        # The task is written in a single call so its lines reach the console
+        # together.
+        lines = [
+            f"""task title: {task["task"]}""",
+            f"""task duration: {task["task_duration"]}""",
+            f"""note: {task["note"]}""",
+            "=" * 100,
+        ]
+        if first:
+            lines.insert(0, "=" * 100)
+        print("\n".join(lines))
@@ -1,9 +1,15 @@
-import pickle
 import logging
+import os
+import pickle
 from pathlib import Path
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Default filenames of the earlier formats, looked up next to the configured
+# file, newest first.
+LEGACY_FILENAMES = ("modifications.json", "modifications.pickle")
+
 
 class ModificationService:
     def __init__(self, mod_file: Path):
@@ -16,53 +22,177 @@ class ModificationService:
             The file path to store modifications.
         """
         self.mod_filepath = Path(mod_file)
+        self._cached_modifications = []
+        self._cached_mtime = None
+        # Legacy modifications that could not be written as JSON Lines yet.
+        self._unmigrated_modifications = None
+        self._migrate_legacy_file()
+
+    def _migrate_legacy_file(self):
+        """
+        Rewrite a modifications file saved in an earlier format as JSON Lines.
+
+        Modifications used to be stored as a pickled list and then as a JSON
+        array; either is converted once, so that new entries can be appended.
+        If the configured file does not exist yet, a file left under an earlier
+        default filename in the same directory is converted into it instead.
+        """
+        source_filepath = self.mod_filepath
+        if not source_filepath.exists():
+            for filename in LEGACY_FILENAMES:
+                legacy_filepath = self.mod_filepath.with_name(filename)
+                if legacy_filepath != self.mod_filepath and legacy_filepath.exists():
+                    source_filepath = legacy_filepath
+                    break
+        try:
+            data = source_filepath.read_bytes()
+        except FileNotFoundError:
+            return
+
+        # A pickle starts with the PROTO opcode, and a JSON array with "[",
+        # whereas every JSON Lines entry starts with a quoted string.
+        modifications = None
+        try:
+            if data.startswith(b"\x80"):
+                modifications = pickle.loads(data)
+            elif data.lstrip().startswith(b"["):
+                modifications = orjson.loads(data)
+        except Exception as e:
+            logger.error(
+                f"Failed to read legacy modifications from {source_filepath}: {e}"
+            )
+            return
+        if not isinstance(modifications, list):
+            return
+
+        if self._write_modifications(modifications):
+            logger.info(
+                f"Migrated {len(modifications)} modifications from {source_filepath} to {self.mod_filepath}."
+            )
+        else:
+            # Kept in memory, so they are still used and written with the next save.
+            self._unmigrated_modifications = modifications
+
+    def _write_modifications(self, modifications: list) -> bool:
+        """
+        Replace the modifications file with the given modifications as JSON Lines.
+
+        The file is written to a temporary file that then replaces it, so a
+        crash leaves either the old or the new file in place.
+
+        Parameters
+        ----------
+        modifications : list
+            The modifications to write.
+
+        Returns
+        -------
+        bool
+            True if the file was written, False otherwise.
+        """
+        tmp_filepath = self.mod_filepath.with_name(self.mod_filepath.name + ".tmp")
+        try:
+            tmp_filepath.write_bytes(
+                b"".join(orjson.dumps(entry) + b"\n" for entry in modifications)
+            )
+            os.replace(tmp_filepath, self.mod_filepath)
+            return True
+        except OSError as e:
+            logger.error(f"Failed to write modifications to {self.mod_filepath}: {e}")
+            return False
+
+    def _mtime(self) -> int | None:
+        """
+        Return the modification time of the modifications file.
+
+        Returns
+        -------
+        int or None
+            The modification time in nanoseconds, or None if the file does not exist.
+        """
+        try:
+            return self.mod_filepath.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
 
     def load_modifications(self) -> list:
         """
-        Load modifications from a pickle file.
+        Load modifications from a JSON Lines file.
 
         Returns
         -------
         list
             A list of modifications.
         """
-        if not self.mod_filepath.exists():
+        if self._unmigrated_modifications is not None:
+            return list(self._unmigrated_modifications)
+        mtime = self._mtime()
+        if mtime is None:
             logger.info(
                 f"No modifications file found at {self.mod_filepath}. Starting with an empty list."
             )
+            self._cached_modifications = []
+            self._cached_mtime = None
             return []
+        # The file is only parsed again after it has been modified.
+        if mtime == self._cached_mtime:
+            return list(self._cached_modifications)
 
         try:
-            with self.mod_filepath.open("rb") as file:
-                modifications = pickle.load(file)
-            if not isinstance(modifications, list):
-                logger.error(f"Invalid format in {self.mod_filepath}. Expected a list.")
-                return []
+            modifications = []
+            with self.mod_filepath.open("rb") as f:
+                for line_number, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    # A line left half-written by a crash only loses itself.
+                    try:
+                        modifications.append(orjson.loads(line))
+                    except orjson.JSONDecodeError as e:
+                        logger.warning(
+                            f"Skipping invalid line {line_number} in {self.mod_filepath}: {e}"
+                        )
             logger.info(
                 f"Loaded {len(modifications)} modifications from {self.mod_filepath}."
             )
-            return modifications
+            self._cached_modifications = modifications
+            self._cached_mtime = mtime
+            return list(modifications)
         except Exception as e:
             logger.error(f"Failed to load modifications from {self.mod_filepath}: {e}")
             return []
 
     def save_modifications(self, modification: str):
         """
-        Save a single modification to a pickle file by appending it to a list of modifications.
+        Save a single modification by appending it as a line to a JSON Lines file.
 
         Parameters
         ----------
         modification : str
             A single modification string to save.
         """
-        modifications = self.load_modifications()
-        modifications.append(modification)
-        # to prevent an excessive increase in modifications.
-        if len(modification) > 30:
-            modification = modification[:30]
+        if self._unmigrated_modifications is not None:
+            # Appending to a file still in a legacy format would corrupt it.
+            self._unmigrated_modifications.append(modification)
+            if self._write_modifications(self._unmigrated_modifications):
+                self._unmigrated_modifications = None
+                logger.info(f"Saved modification to {self.mod_filepath}.")
+            return
         try:
-            with self.mod_filepath.open("wb") as file:
-                pickle.dump(modifications, file)
+            # The cached list stays valid across our own append, as long as it
+            # matched the file before it.
+            in_sync = self._mtime() == self._cached_mtime
+            line = orjson.dumps(modification) + b"\n"
+            with self.mod_filepath.open("ab+") as f:
+                # Start on a new line if the last one was cut off by a crash, so
+                # this entry is not merged into it.
+                if f.tell() > 0:
+                    f.seek(-1, 2)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.write(line)
+            if in_sync:
+                self._cached_modifications.append(modification)
+                self._cached_mtime = self._mtime()
             logger.info(f"Saved modification to {self.mod_filepath}.")
         except Exception as e:
             logger.error(f"Failed to save modifications to {self.mod_filepath}: {e}")
@@ -0,0 +1,77 @@
+import base64
+import json
+import logging
+import time
+from typing import Any
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from services.http_service import API_NUM_RETRIES
+
+logger = logging.getLogger(__name__)
+HttpService = Any
+
+
+class PubSubService:
+    def __init__(self, http_service: HttpService, subscription: str):
+        """
+        Initialize the Cloud Pub/Sub API service.
+
+        Parameters
+        ----------
+        http_service : HttpService
+            An instance of HttpService providing authorized HTTP clients.
+        subscription : str
+            The pull subscription receiving Gmail push notifications.
+        """
+        self.subscription = subscription
+
+        try:
+            self.service = build(
+                "pubsub", "v1", http=http_service.get(), static_discovery=True
+            )
+            logger.info("Initialized Pub/Sub API service.")
+        except HttpError as error:
+            logger.error(f"Error initializing Pub/Sub service: {error}")
+            raise Exception(f"An error occurred: {error}")
+
+    def wait_for_notifications(
+        self, max_messages: int = 10, timeout: float | None = None
+    ) -> list:
+        """
+        Block until Gmail notifications arrive on the subscription and acknowledge them.
+
+        Parameters
+        ----------
+        max_messages : int
+            Maximum number of notifications to receive at a time.
+        timeout : float or None
+            Seconds to wait before giving up, or None to wait indefinitely.
+
+        Returns
+        -------
+        list
+            A list of notification payloads, each holding 'emailAddress' and 'historyId'.
+            Empty if the timeout expired first.
+        """
+        subscriptions = self.service.projects().subscriptions()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            response = subscriptions.pull(
+                subscription=self.subscription, body={"maxMessages": max_messages}
+            ).execute(num_retries=API_NUM_RETRIES)
+            received_messages = response.get("receivedMessages", [])
+            if received_messages:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+
+        subscriptions.acknowledge(
+            subscription=self.subscription,
+            body={"ackIds": [message["ackId"] for message in received_messages]},
+        ).execute(num_retries=API_NUM_RETRIES)
+        notifications = [
+            json.loads(base64.b64decode(message["message"]["data"]))
+            for message in received_messages
+        ]
+        logger.info(f"Received {len(notifications)} Gmail notifications")
+        return notifications
@@ -0,0 +1,99 @@
+import unittest
+from unittest import mock
+from utils.email_utils import EmailUtils
+
+
+def make_ics(method: str | None) -> bytes:
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0"]
+    if method:
+        lines.append(f"METHOD:{method}")
+    lines += [
+        "BEGIN:VEVENT",
+        "SUMMARY:Weekly team meeting",
+        "DTSTART:20260101T100000Z",
+        "DTEND:20260101T110000Z",
+        "END:VEVENT",
+        "END:VCALENDAR",
+    ]
+    return ("\r\n".join(lines) + "\r\n").encode()
+
+
+class FastInviteCheckTest(unittest.TestCase):
+    def test_request_is_invitation(self):
+        self.assertIs(
+            EmailUtils._fast_invite_check(make_ics("REQUEST"), "Quarterly review"),
+            True,
+        )
+
+    def test_reply_is_not_invitation(self):
+        for subject in [
+            "Accepted: Invitation: Weekly team meeting @ Thu Jan 1, 2026",
+            "Declined: Invitation: Weekly team meeting @ Thu Jan 1, 2026",
+        ]:
+            with self.subTest(subject=subject):
+                self.assertIs(
+                    EmailUtils._fast_invite_check(make_ics("REPLY"), subject), False
+                )
+
+    def test_cancel_is_not_invitation(self):
+        self.assertIs(
+            EmailUtils._fast_invite_check(
+                make_ics("CANCEL"), "Canceled: Weekly team meeting"
+            ),
+            False,
+        )
+
+    def test_counter_proposals_are_not_invitations(self):
+        for method in ["COUNTER", "DECLINECOUNTER"]:
+            with self.subTest(method=method):
+                self.assertIs(
+                    EmailUtils._fast_invite_check(
+                        make_ics(method), "New Time Proposed: Weekly team meeting"
+                    ),
+                    False,
+                )
+
+    def test_event_with_invitation_subject(self):
+        self.assertIs(
+            EmailUtils._fast_invite_check(make_ics(None), "Invitation: Kickoff"), True
+        )
+
+    def test_undecided_without_method_or_subject(self):
+        self.assertIsNone(EmailUtils._fast_invite_check(make_ics(None), "Kickoff"))
+        self.assertIsNone(EmailUtils._fast_invite_check(make_ics("PUBLISH"), "Kickoff"))
+
+
+class ProcessMessageTest(unittest.TestCase):
+    def setUp(self):
+        self.llm_service = mock.Mock()
+        self.email_utils = EmailUtils(mock.Mock(), self.llm_service)
+        self.gmail_service = mock.Mock()
+
+    def test_reply_skips_llm(self):
+        self.gmail_service.extract_payload_parts.return_value = (
+            "Accepted: Invitation: Weekly team meeting",
+            "",
+            make_ics("REPLY"),
+        )
+        result = self.email_utils.process_message(
+            {"id": "1"}, self.gmail_service, "label"
+        )
+        self.assertIsNone(result)
+        self.llm_service.is_meeting_invite.assert_not_called()
+
+    def test_undecided_asks_llm(self):
+        self.gmail_service.extract_payload_parts.return_value = (
+            "Kickoff",
+            "",
+            make_ics(None),
+        )
+        self.llm_service.is_meeting_invite.return_value = False
+        result = self.email_utils.process_message(
+            {"id": "1"}, self.gmail_service, "label"
+        )
+        self.assertIsNone(result)
+        self.llm_service.is_meeting_invite.assert_called_once_with("Kickoff", "")
+
+
+if __name__ == "__main__":
+    unittest.main()
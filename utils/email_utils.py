@@ -1,4 +1,5 @@
 import logging
+import re
 from icalendar import Calendar
 from typing import Any
 from models.models import EventInfo
@@ -6,6 +7,33 @@ from models.models import EventInfo
 logger = logging.getLogger(__name__)
 DriveService = LLMService = GmailService = Any
 
+_METHOD_RE = re.compile(rb"^METHOD:([A-Z-]+)\r?$", re.IGNORECASE | re.MULTILINE)
+_EVENT_RE = re.compile(rb"^BEGIN:VEVENT\r?$", re.IGNORECASE | re.MULTILINE)
+_INVITE_SUBJECT_RE = re.compile(r"invitation|invite|meeting|calendar", re.IGNORECASE)
+
+# iTIP methods of replies to and cancellations of an invitation; their subjects
+# quote the original one, such as "Accepted: Invitation: ...".
+_NON_INVITE_METHODS = {b"REPLY", b"CANCEL", b"COUNTER", b"DECLINECOUNTER"}
+
+
+def _aslist(value: Any) -> list:
+    """
+    Normalize an iCalendar property that may occur once or several times.
+
+    Parameters
+    ----------
+    value : Any
+        The property value, a list of values, or None if absent.
+
+    Returns
+    -------
+    list
+        The values of the property.
+    """
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
 
 class EmailUtils:
     def __init__(self, drive_service: DriveService, llm_service: LLMService):
@@ -31,7 +59,7 @@ class EmailUtils:
         Parameters
         ----------
         msg : dict
-            The message object from Gmail.
+            The message resource from Gmail, fetched in the 'full' format.
         gmail_service : GmailService
             An instance of GmailService.
         processed_label_id : str
@@ -42,19 +70,57 @@ class EmailUtils:
         EventInfo or None
             Extracted EventInfo object if message is a meeting invite, otherwise None.
         """
-        email_message = gmail_service.get_email_message(msg["id"])
-        subject, body, ics_file_data = gmail_service.extract_email_parts(email_message)
+        subject, body, ics_file_data = gmail_service.extract_payload_parts(msg)
 
-        if ics_file_data and self.llm_service.is_meeting_invite(subject, body):
+        is_invite = False
+        if ics_file_data:
+            is_invite = self._fast_invite_check(ics_file_data, subject)
+            if is_invite is None:
+                is_invite = self.llm_service.is_meeting_invite(subject, body)
+
+        if is_invite:
             logger.info(f"Email '{subject}' is identified as a meeting invitation")
-            event_info = self.parse_ics_file(ics_file_data)
-            event_info = event_info.copy(update={"message_id": msg["id"]})
-            return event_info
+            return self.parse_ics_file(ics_file_data, msg["id"])
         else:
             logger.info(f"Email '{subject}' is not a meeting invitation")
             return None
 
-    def parse_ics_file(self, ics_data_bytes: bytes) -> EventInfo:
+    @staticmethod
+    def _fast_invite_check(ics_data_bytes: bytes, subject: str) -> bool | None:
+        """
+        Classify an obvious case without consulting the LLM.
+
+        An iCalendar REQUEST is an invitation by definition, while a reply to
+        or cancellation of one never is. Otherwise an event whose email subject
+        says it is an invitation is taken as one, and anything else is left to
+        the LLM.
+
+        Parameters
+        ----------
+        ics_data_bytes : bytes
+            The raw bytes of the .ics file.
+        subject : str
+            The subject line of the email.
+
+        Returns
+        -------
+        bool or None
+            True if the email is certainly a meeting invitation, False if it is
+            certainly not, and None if undecided.
+        """
+        match = _METHOD_RE.search(ics_data_bytes)
+        method = match.group(1).upper() if match else None
+        if method == b"REQUEST":
+            return True
+        if method in _NON_INVITE_METHODS:
+            return False
+        if _INVITE_SUBJECT_RE.search(subject) and _EVENT_RE.search(ics_data_bytes):
+            return True
+        return None
+
+    def parse_ics_file(
+        self, ics_data_bytes: bytes, message_id: str = ""
+    ) -> EventInfo | None:
         """
         Parse the .ics file from the email and extract event information.
 
@@ -62,40 +128,45 @@ class EmailUtils:
         ----------
         ics_data_bytes : bytes
             The raw bytes of the .ics file.
+        message_id : str
+            The ID of the email message the .ics file belongs to.
 
         Returns
         -------
-        EventInfo
-            An object containing detailed information about the event.
+        EventInfo or None
+            An object containing detailed information about the event, or None if
+            the file holds no event.
         """
         logger.info("Parsing .ics file to extract event information")
-        ics_data_text = ics_data_bytes.decode("utf-8")
-        calendar = Calendar.from_ical(ics_data_text)
-
-        for event in calendar.walk("VEVENT"):
-            attachments = (
-                [event.get("ATTACH")]
-                if isinstance(event.get("ATTACH"), str)
-                else event.get("ATTACH")
-            )
-            attendees = event.get("ATTENDEE")
-            if isinstance(attendees, list):
-                num_ppl = len(attendees)
-            else:
-                num_ppl = 1 if attendees else 0
-            event_info = EventInfo(
-                message_id="",  # Placeholder; will be updated later
-                event_title=event.get("SUMMARY"),
-                description=event.get("DESCRIPTION", ""),
-                start=event.get("DTSTART").dt,
-                end=event.get("DTEND").dt,
-                event_duration=event.get("DTEND").dt - event.get("DTSTART").dt,
-                num_ppl=num_ppl,
-                att_contents=(
-                    self.drive_service.fetch_attachments(attachments, self.llm_service)
-                    if attachments
-                    else []
-                ),
-            )
-            logger.info(f"Extracted event information: {event_info}")
-            return event_info
+        # from_ical accepts the attachment bytes as they are; decoding them to
+        # str first only adds a full copy of the file.
+        calendar = Calendar.from_ical(ics_data_bytes)
+
+        # Only the first event of the invitation is used.
+        event = next(iter(calendar.walk("VEVENT")), None)
+        if event is None:
+            return None
+
+        attachments = _aslist(event.get("ATTACH"))
+        start = event.get("DTSTART").dt
+        end = event.get("DTEND").dt
+        # icalendar has already typed every value, so the model is built
+        # without running validation again.
+        event_info = EventInfo.model_construct(
+            message_id=message_id,
+            event_title=str(event.get("SUMMARY", "")),
+            description=str(event.get("DESCRIPTION", "")),
+            start=start,
+            end=end,
+            event_duration=end - start,
+            num_ppl=len(_aslist(event.get("ATTENDEE"))),
+            att_contents=(
+                self.drive_service.fetch_attachments(attachments, self.llm_service)
+                if attachments
+                else []
+            ),
+        )
+        # Formatting is deferred because the event carries every attachment
+        # summary and is only rendered if INFO is enabled.
+        logger.info("Extracted event information: %s", event_info)
+        return event_info